@@ -1,71 +1,146 @@
+import io
 import streamlit as st
 from rdkit import Chem
-from rdkit.Chem import AllChem, Draw, Descriptors
-import py3Dmol
-import pandas as pd
+from rdkit.Chem import AllChem
+from rdkit.ML.Descriptors.MoleculeDescriptors import MolecularDescriptorCalculator
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
-# Function to convert SMILES to 3D XYZ format
-def smiles_to_xyz(smiles):
+# Cache settings for the RDKit computations (keyed by canonical SMILES)
+CACHE_TTL = 24 * 60 * 60
+CACHE_MAX_ENTRIES = 1024
+# Hash RDKit molecules by their canonical SMILES when they are passed to cached functions
+MOL_HASH_FUNCS = {Chem.Mol: Chem.MolToSmiles}
+# Input bounds so pathological inputs fail fast instead of tying up the 3D embedder
+MAX_SMILES_LENGTH = 400
+MAX_HEAVY_ATOMS = 150
+
+# Function to parse a SMILES string once and return the molecule with its canonical SMILES
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def get_mol(smiles):
     mol = Chem.MolFromSmiles(smiles)
     if mol is None:
+        return None, None
+    return mol, Chem.MolToSmiles(mol)
+
+# Function to convert a molecule to 3D XYZ format (optionally heavy atoms only)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, hash_funcs=MOL_HASH_FUNCS)
+def smiles_to_xyz(mol, add_hs=True):
+    if mol is None or mol.GetNumHeavyAtoms() > MAX_HEAVY_ATOMS:
         return None
-    mol = Chem.AddHs(mol)
-    AllChem.EmbedMolecule(mol, AllChem.ETKDG())
+    if add_hs:
+        mol = Chem.AddHs(mol)
+    # ETKDGv3 geometries are good enough for display, so no force-field minimization
+    params = AllChem.ETKDGv3()
+    params.useSmallRingTorsions = True
+    params.randomSeed = 0xf00d  # Fixed seed keeps the cached conformers deterministic
+    AllChem.EmbedMolecule(mol, params)
     conf = mol.GetConformer()
 
-    xyz = []
-    num_atoms = mol.GetNumAtoms()
-    xyz.append(f"{num_atoms}")
-    xyz.append("Generated by RDKit")
-    for i in range(num_atoms):
-        atom = mol.GetAtomWithIdx(i)
-        pos = conf.GetAtomPosition(i)
-        xyz.append(f"{atom.GetSymbol()} {pos.x:.4f} {pos.y:.4f} {pos.z:.4f}")
+    # Fetch all symbols and coordinates up front instead of per-atom lookups
+    symbols = [atom.GetSymbol() for atom in mol.GetAtoms()]
+    coords = conf.GetPositions()
+    xyz = [f"{mol.GetNumAtoms()}", "Generated by RDKit"]
+    xyz.extend(f"{symbol} {x:.4f} {y:.4f} {z:.4f}" for symbol, (x, y, z) in zip(symbols, coords))
     return "\n".join(xyz)
 
+# Function to render the 2D depiction as PNG bytes (bytes cache well, PIL images do not)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def render_2d_png(canonical_smiles):
+    from rdkit.Chem import Draw  # Imported lazily; pulls in PIL/Cairo
+    mol = Chem.MolFromSmiles(canonical_smiles)
+    img = Draw.MolToImage(mol, size=(300, 300))
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+# Visualization style options
+style_options = {
+    'Ball and Stick': {'stick': {}, 'sphere': {'radius': 0.5}},
+    'Stick': {'stick': {}},
+    'Spacefill': {'sphere': {}}
+}
+
+# Function to build the py3Dmol viewer HTML for an .xyz block and a style name
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+def make_3d_html(xyz_content, style_key, width, height):
+    import py3Dmol  # Imported lazily to keep cold starts fast
+    xyzview = py3Dmol.view(width=width, height=height)
+    xyzview.addModel(xyz_content, 'xyz')
+    xyzview.setStyle(style_options[style_key])
+    xyzview.zoomTo()
+    return xyzview._make_html()
+
+# Descriptors shared by the property table and the drug-likeness check, computed in one batch
+DESCRIPTOR_NAMES = ['MolWt', 'HeavyAtomCount', 'RingCount', 'NumRotatableBonds',
+                    'NumHAcceptors', 'NumHDonors', 'TPSA', 'MolMR', 'MolLogP']
+
+# Function to get the shared descriptor calculator (one instance across reruns and sessions)
+@st.cache_resource
+def get_descriptor_calc():
+    return MolecularDescriptorCalculator(DESCRIPTOR_NAMES)
+
+# Function to compute all descriptors of a molecule once; the property table and
+# the drug-likeness check are both views over this dict
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, hash_funcs=MOL_HASH_FUNCS)
+def compute_all(mol):
+    return dict(zip(DESCRIPTOR_NAMES, get_descriptor_calc().CalcDescriptors(mol)))
+
 # Function to calculate molecular properties
-def calculate_properties(smiles):
-    mol = Chem.MolFromSmiles(smiles)
+def calculate_properties(mol):
     if mol is None:
         return None
+    d = compute_all(mol)
     properties = {
-        "Molecular Weight (g/mol)": round(Descriptors.MolWt(mol), 1),
-        "Heavy Atoms": mol.GetNumHeavyAtoms(),
-        "Rings": Chem.rdMolDescriptors.CalcNumRings(mol),
-        "Rotatable Bonds": Chem.rdMolDescriptors.CalcNumRotatableBonds(mol),
-        "HB Acceptors": Descriptors.NumHAcceptors(mol),
-        "HB Donors": Descriptors.NumHDonors(mol),
-        "Topo. Polar Surface Area (Å²)": round(Descriptors.TPSA(mol), 2),
-        "Mol Refractivity": round(Descriptors.MolMR(mol), 2),
-        "clogP": round(Descriptors.MolLogP(mol), 2),
+        "Molecular Weight (g/mol)": round(d["MolWt"], 1),
+        "Heavy Atoms": d["HeavyAtomCount"],
+        "Rings": d["RingCount"],
+        "Rotatable Bonds": d["NumRotatableBonds"],
+        "HB Acceptors": d["NumHAcceptors"],
+        "HB Donors": d["NumHDonors"],
+        "Topo. Polar Surface Area (Å²)": round(d["TPSA"], 2),
+        "Mol Refractivity": round(d["MolMR"], 2),
+        "clogP": round(d["MolLogP"], 2),
     }
     return properties
 
 # Function to evaluate drug-likeness (Lipinski's Rule of Five)
-def evaluate_drug_likeness(smiles):
-    mol = Chem.MolFromSmiles(smiles)
+def evaluate_drug_likeness(mol):
     if mol is None:
         return None
-    properties = {
-        "Molecular Weight": Descriptors.MolWt(mol),
-        "LogP": Descriptors.MolLogP(mol),
-        "H-bond Donors": Descriptors.NumHDonors(mol),
-        "H-bond Acceptors": Descriptors.NumHAcceptors(mol)
-    }
+    d = compute_all(mol)
     # Evaluate Lipinski's Rule of Five
     lipinski = {
         "Rule of Five Pass": all([
-            properties["Molecular Weight"] <= 500,
-            properties["LogP"] <= 5,
-            properties["H-bond Donors"] <= 5,
-            properties["H-bond Acceptors"] <= 10
+            d["MolWt"] <= 500,
+            d["MolLogP"] <= 5,
+            d["NumHDonors"] <= 5,
+            d["NumHAcceptors"] <= 10
         ]),
-        **properties
+        "Molecular Weight": d["MolWt"],
+        "LogP": d["MolLogP"],
+        "H-bond Donors": d["NumHDonors"],
+        "H-bond Acceptors": d["NumHAcceptors"]
     }
     return lipinski
 
 
+HTTP_TIMEOUT = (3, 5)  # (connect, read) seconds
+# ProTox-II lookups stay off until the real API endpoint is wired up
+ENABLE_TOXICITY = False
+
+# Function to get the shared HTTP session so PubChem/ProTox-II lookups reuse pooled TCP/TLS connections
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                          max_retries=Retry(total=2, backoff_factor=0.3)))
+    return session
+
+
 ####### HH+ working
 
 # Function to fetch toxicity prediction from ProTox-II API
@@ -73,7 +148,7 @@ def predict_toxicity(smiles):
     try:
         url = "https://tox-new.charite.de/protox_II/api"  # Replace with actual API endpoint
         params = {"smiles": smiles}
-        response = requests.post(url, json=params)
+        response = get_session().post(url, json=params, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
         data = response.json()
 
@@ -89,6 +164,21 @@ def predict_toxicity(smiles):
 
 ####### HH- Working
 
+# Function to fetch the PubChem IUPAC name for a SMILES string (None if not in PubChem).
+# Request and format errors propagate, so only successful lookups are cached.
+@st.cache_data(ttl=60 * 60)
+def fetch_pubchem_name(smiles):
+    # Use the PUG REST API to search for the molecule in PubChem
+    url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/smiles/{quote(smiles, safe='')}/property/IUPACName/JSON"
+    response = get_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+
+    # Parse the response JSON
+    data = response.json()
+    if "PropertyTable" in data and data["PropertyTable"]["Properties"]:
+        return data["PropertyTable"]["Properties"][0].get("IUPACName", "Name not available")
+    return None
+
 def check_molecule_in_pubchem(smiles):
     """
     Checks if a molecule exists in PubChem using its SMILES string and retrieves its name.
@@ -101,15 +191,8 @@ def check_molecule_in_pubchem(smiles):
         str: A message or name of the molecule if found.
     """
     try:
-        # Use the PUG REST API to search for the molecule in PubChem
-        url = f"https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/smiles/{smiles}/property/IUPACName/JSON"
-        response = requests.get(url)
-        response.raise_for_status()
-
-        # Parse the response JSON
-        data = response.json()
-        if "PropertyTable" in data and data["PropertyTable"]["Properties"]:
-            name = data["PropertyTable"]["Properties"][0].get("IUPACName", "Name not available")
+        name = fetch_pubchem_name(smiles)
+        if name is not None:
             return True, f"Molecule found in PubChem: {name}"
         else:
             return False, "Molecule not found in PubChem."
@@ -119,12 +202,17 @@ def check_molecule_in_pubchem(smiles):
     except KeyError:
         return False, "Unexpected API response format."
 
-
 # Initialize session state for SMILES and .xyz content
 if "smiles" not in st.session_state:
     st.session_state["smiles"] = "CCCC"
+if "canonical_smiles" not in st.session_state:
+    st.session_state["canonical_smiles"] = None
 if "xyz_content" not in st.session_state:
     st.session_state["xyz_content"] = None
+if "pubchem_result" not in st.session_state:
+    st.session_state["pubchem_result"] = None
+if "toxicity" not in st.session_state:
+    st.session_state["toxicity"] = None
 
 # Streamlit App
 st.title("SMILES Visualization and Properties")
@@ -132,34 +220,50 @@ st.text("Hassan Harb")
 st.text("Last updated Dec 2, 2024")
 # Default molecule (Phenol)
 default_smiles = "Oc1ccccc1"
-smiles_input = st.text_input("Enter a SMILES string:", st.session_state.get("smiles", default_smiles))
 
-# Visualization style options
-style_options = {
-    'Ball and Stick': {'stick': {}, 'sphere': {'radius': 0.5}},
-    'Stick': {'stick': {}},
-    'Spacefill': {'sphere': {}}
-}
-selected_style = st.radio('Select visualization style', list(style_options.keys()))
+# Inputs live in a form so typing or picking a style doesn't rerun the script until submit
+with st.form("viz_form"):
+    smiles_input = st.text_input("Enter a SMILES string:", st.session_state.get("smiles", default_smiles))
+    selected_style = st.radio('Select visualization style', list(style_options.keys()))
+    show_hydrogens = st.checkbox("Show hydrogens in 3D", value=True)
+    submitted = st.form_submit_button("Visualize")
 
 # Button to process and visualize the SMILES
-if st.button("Visualize"):
-    mol = Chem.MolFromSmiles(smiles_input)
-    if mol is None:
-        st.error("Invalid SMILES string. Please try again.")
+if submitted:
+    if len(smiles_input) > MAX_SMILES_LENGTH:
+        mol, canonical_smiles = None, None
+        st.warning(f"SMILES string is too long (limit is {MAX_SMILES_LENGTH} characters).")
     else:
+        mol, canonical_smiles = get_mol(smiles_input)
+        if mol is None:
+            st.error("Invalid SMILES string. Please try again.")
+        elif mol.GetNumHeavyAtoms() > MAX_HEAVY_ATOMS:
+            mol = None
+            st.warning(f"Molecule is too large to visualize (limit is {MAX_HEAVY_ATOMS} heavy atoms).")
+    if mol is not None:
+        # 3D embedding, 2D rendering and the PubChem/ProTox-II lookups are independent, so run them
+        # concurrently; the HTTP requests overlap and total latency is the slowest task, not the sum.
+        # The embedding task gets its own copy of the molecule since RDKit caches properties on it.
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            future_xyz = executor.submit(smiles_to_xyz, Chem.Mol(mol), show_hydrogens)
+            future_image = executor.submit(render_2d_png, canonical_smiles)
+            future_pubchem = executor.submit(check_molecule_in_pubchem, canonical_smiles)
+            future_toxicity = executor.submit(predict_toxicity, canonical_smiles) if ENABLE_TOXICITY else None
         st.session_state["smiles"] = smiles_input  # Save SMILES in session state
-        st.session_state["xyz_content"] = smiles_to_xyz(smiles_input)  # Save .xyz content
+        st.session_state["canonical_smiles"] = canonical_smiles  # Canonical form used as the cache key
+        st.session_state["xyz_content"] = future_xyz.result()  # Save .xyz content
+        future_image.result()  # Warms the 2D depiction cache used below
+        st.session_state["pubchem_result"] = future_pubchem.result()
+        st.session_state["toxicity"] = future_toxicity.result() if future_toxicity else None
 
 # Only proceed if SMILES and .xyz content are valid
-if st.session_state["smiles"] and st.session_state["xyz_content"]:
-    mol = Chem.MolFromSmiles(st.session_state["smiles"])
+if st.session_state["canonical_smiles"] and st.session_state["xyz_content"]:
+    mol, _ = get_mol(st.session_state["canonical_smiles"])
     col1, col2 = st.columns(2)
 
     with col1:
         st.subheader("2D Structure")
-        img = Draw.MolToImage(mol, size=(300, 300))
-        st.image(img, caption="2D Structure")
+        st.image(render_2d_png(st.session_state["canonical_smiles"]), caption="2D Structure")
 
     with col2:
         st.subheader("3D Structure")
@@ -168,14 +272,9 @@ if st.session_state["smiles"] and st.session_state["xyz_content"]:
         width = int(320.0 * scale)
         height = int(300.0 * scale)
 
-        # Visualize the 3D structure using py3Dmol
-        xyzview = py3Dmol.view(width=width, height=height)
-        xyzview.addModel(xyz_content, 'xyz')
-        xyzview.setStyle(style_options[selected_style])  # Use selected visualization style
-        xyzview.zoomTo()
-
-        # Display the 3D visualization in Streamlit
-        st.components.v1.html(xyzview._make_html(), width=width, height=height, scrolling=False)
+        # Display the 3D visualization (py3Dmol HTML) in the selected style
+        st.components.v1.html(make_3d_html(xyz_content, selected_style, width, height),
+                              width=width, height=height, scrolling=False)
 
     # Add the download button for the .xyz file
     st.download_button(
@@ -187,25 +286,23 @@ if st.session_state["smiles"] and st.session_state["xyz_content"]:
 
     # Molecular Properties
     st.subheader("Molecular Properties")
-    properties = calculate_properties(st.session_state["smiles"])
+    properties = calculate_properties(mol)
     if properties:
-        df = pd.DataFrame(list(properties.items()), columns=["Property", "Value"])
-        df["Value"] = df["Value"].astype(str)  # Convert all values to strings
-        st.table(df)
+        st.table({"Property": list(properties.keys()),
+                  "Value": [str(v) for v in properties.values()]})  # Convert all values to strings
     else:
         st.error("Failed to calculate molecular properties.")
 
     # Drug-Likeness Evaluation
-    drug_likeness = evaluate_drug_likeness(st.session_state["smiles"])
+    drug_likeness = evaluate_drug_likeness(mol)
     if drug_likeness:
         st.subheader("Drug-Likeness (Lipinski's Rule of Five)")
-        df_drug = pd.DataFrame(list(drug_likeness.items()), columns=["Property", "Value"])
-        df_drug["Value"] = df_drug["Value"].astype(str)  # Convert all values to strings
-        st.table(df_drug)
+        st.table({"Property": list(drug_likeness.keys()),
+                  "Value": [str(v) for v in drug_likeness.values()]})  # Convert all values to strings
 
 
     st.subheader("Pubchem Check")
-    exists, message = check_molecule_in_pubchem(st.session_state["smiles"])
+    exists, message = st.session_state["pubchem_result"]
     if exists:
         st.write(message)
     else:
@@ -214,6 +311,11 @@ if st.session_state["smiles"] and st.session_state["xyz_content"]:
 
     # Toxicity Prediction
     st.subheader("Toxicity Prediciton")
-    st.write("coming soon")
+    toxicity = st.session_state["toxicity"]
+    if toxicity:
+        st.table({"Property": list(toxicity.keys()),
+                  "Value": [str(v) for v in toxicity.values()]})
+    else:
+        st.write("coming soon")
 
 